@@ -1,4 +1,11 @@
 from io import BytesIO
+import asyncio
+import base64
+import threading
+import time
+import uuid
+import httpx
+import numpy as np
 import requests
 from datetime import datetime
 from urllib.parse import urlparse
@@ -11,34 +18,42 @@ from reportlab.lib.colors import HexColor
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 import os
+import grpc
 import streamlit as st
 from audiorecorder import audiorecorder
 from dotenv import dotenv_values
-from hashlib import md5
-from openai import OpenAI
+import xxhash
+from openai import AsyncOpenAI
 from pydub import AudioSegment
-from qdrant_client import QdrantClient
-from qdrant_client.models import PointStruct, Distance, VectorParams
+from pydub.silence import detect_leading_silence, detect_silence
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.models import (
+    PointStruct, Distance, VectorParams, VectorParamsDiff, PayloadSchemaType, OrderBy, Direction,
+    BinaryQuantization, BinaryQuantizationConfig, SearchParams, QuantizationSearchParams,
+    PayloadSelectorInclude, HnswConfigDiff,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+)
 from streamlit_option_menu import option_menu
 from streamlit.errors import StreamlitSecretNotFoundError
 from pathlib import Path
 from qdrant_client.http.exceptions import UnexpectedResponse
 
 # Configuration & Env
-env = dotenv_values(".env")
-#=======================================================
-# Secrets
-try:
-    if 'QDRANT_URL' in st.secrets:
-        env['QDRANT_URL'] = st.secrets['QDRANT_URL']
-    if 'QDRANT_API_KEY' in st.secrets:
-        env['QDRANT_API_KEY'] = st.secrets['QDRANT_API_KEY']
-    if 'OPENAI_API_KEY' in st.secrets:
-        env['OPENAI_API_KEY'] = st.secrets['OPENAI_API_KEY']
-except StreamlitSecretNotFoundError:
-    # Brak pliku secrets.toml – pracujemy na wartościach z .env / lokalnych
-    pass
-#=======================================================
+@st.cache_resource(show_spinner=False)
+def bootstrap():
+    """Jednorazowa inicjalizacja procesu: .env + Secrets (nie czytamy pliku przy każdym rerunie)."""
+    env = dict(dotenv_values(".env"))
+    # Secrets (nadpisują .env)
+    try:
+        for key in ("QDRANT_URL", "QDRANT_API_KEY", "OPENAI_API_KEY", "QDRANT_QUANTIZATION"):
+            if key in st.secrets:
+                env[key] = st.secrets[key]
+    except StreamlitSecretNotFoundError:
+        # Brak pliku secrets.toml – pracujemy na wartościach z .env / lokalnych
+        pass
+    return {"env": env}
+
+env = bootstrap()["env"]
 
 
 
@@ -47,10 +62,59 @@ except StreamlitSecretNotFoundError:
 # Wybór embedowania zgodny z istniejącą kolekcją (3072)
 EMBEDDING_MODEL = "text-embedding-3-large"
 EMBEDDING_DIM = 3072
+# Limit liczby tekstów w jednym żądaniu do endpointu embeddings
+EMBEDDING_BATCH_SIZE = 2048
 
 AUDIO_TRANSCRIBE_MODEL = "whisper-1"
+# Notatki głosowe potrzebują samego tekstu – lżejszy i szybszy model (segmenty/verbose_json ma tylko whisper-1)
+NOTE_TRANSCRIBE_MODEL = "gpt-4o-mini-transcribe"
+# Kopia wysyłana do transkrypcji: mowa w mono 16 kHz – mniejszy upload (odtwarzacz dostaje oryginał)
+TRANSCRIBE_SAMPLE_RATE = 16000
+# Cisza na brzegach nagrania: próg głośności i margines zostawiany przed/po mowie
+SILENCE_THRESHOLD_DBFS = -50.0
+SILENCE_KEEP_MS = 200
+# Dłuższe notatki idą do transkrypcji w ~30 s kawałkach wysyłanych równolegle (cięcie w pauzie przed granicą)
+NOTE_CHUNK_MS = 30_000
+NOTE_CHUNK_SEARCH_MS = 5_000
+# Pauza, w której wolno ciąć: min. długość i próg względem średniej głośności nagrania (szum tła zależy od mikrofonu)
+NOTE_CHUNK_PAUSE_MS = 300
+NOTE_CHUNK_PAUSE_BELOW_DB = 16
+# Ile transkrypcji (odcisk nagrania -> tekst) pamiętamy w sesji
+TRANSCRIPT_MEMO_MAX_ENTRIES = 64
+# Stan zakładki "Dodaj notatkę" po zapisaniu notatki (ustawiany jednym update())
+NOTE_STATE_RESET = {
+    "note_text": "",
+    "note_audio_text": "",
+    "note_audio_bytes": None,
+    "note_audio_bytes_hash": None,
+}
 QDRANT_COLLECTION_NAME = "notes"
 
+# Kwantyzacja wektorów (QDRANT_QUANTIZATION); oryginały leżą na dysku i służą do rescoringu
+#   binary (domyślnie) – 3072 floaty (12 KB) -> 384 B w RAM
+#   scalar – int8, 4x mniej RAM niż float32, dokładniejsza od binarnej
+QDRANT_QUANTIZATION_CONFIGS = {
+    "binary": BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True)),
+    "scalar": ScalarQuantization(
+        scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True),
+    ),
+}
+QDRANT_QUANTIZATION_CONFIG = QDRANT_QUANTIZATION_CONFIGS.get(
+    str(env.get("QDRANT_QUANTIZATION") or "binary").strip().lower(),
+    QDRANT_QUANTIZATION_CONFIGS["binary"],
+)
+# Lista notatek renderuje tylko te pola – reszty payloadu nie przesyłamy
+NOTE_PAYLOAD_SELECTOR = PayloadSelectorInclude(include=["text", "created_at"])
+# Wyszukiwanie semantyczne: kilka najtrafniejszych notatek przez indeks HNSW (bez pełnego skanu)
+SEARCH_RESULTS_LIMIT = 10
+# Limit czasu (s) interaktywnych wywołań Qdranta
+QDRANT_REQUEST_TIMEOUT = 10
+QDRANT_SEARCH_PARAMS = SearchParams(
+    hnsw_ef=64,
+    exact=False,
+    quantization=QuantizationSearchParams(rescore=True, oversampling=2.0),
+)
+
 def is_demo_mode():
     return bool(st.session_state.get("demo_mode"))
 
@@ -63,22 +127,63 @@ def validate_openai_api_key(api_key):
     if len(api_key) < 16:
         return False
     try:
-        client = OpenAI(api_key=api_key, timeout=20.0)
-        next(iter(client.models.list()), None)
+        # Ten sam klient (i pula połączeń) obsłuży potem transkrypcje i embeddingi
+        run_async(get_openai_client_cached(api_key).models.list(timeout=20.0))
         return True
     except Exception:
         return False
 
 
+@st.cache_resource
+def get_async_loop():
+    """Pętla asyncio w osobnym wątku – wspólna dla wszystkich rerunów, więc pula połączeń klienta się nie zamyka."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="async-loop", daemon=True).start()
+    return loop
+
+
+def run_async(*coros):
+    """Uruchamia korutyny współbieżnie (asyncio.gather) i czeka na wyniki.
+
+    Korutyny działają w wątku pętli, więc nie mogą wywoływać st.* ani czytać st.session_state –
+    klienty należy pobrać w skrypcie i przekazać jako argumenty.
+    Dla jednej korutyny zwraca jej wynik, dla kilku – listę wyników w tej samej kolejności.
+    """
+    async def _gather():
+        return await asyncio.gather(*coros)
+
+    results = submit_async(_gather()).result()
+    return results[0] if len(coros) == 1 else results
+
+
+def submit_async(coro):
+    """Jak run_async, ale bez czekania – zwraca concurrent.futures.Future (np. do prefetchu)."""
+    return asyncio.run_coroutine_threadsafe(coro, get_async_loop())
+
+
+# Transkrypcja idzie przez API – nie ma lokalnego modelu do wczytania; jedynym "zasobem" jest ten klient,
+# tworzony raz na klucz i współdzielony między rerunami
+@st.cache_resource(max_entries=32)
+def get_openai_client_cached(api_key):
+    # Domyślny httpx.AsyncClient dławi się przy wielu równoległych żądaniach – większa pula i HTTP/2
+    http_client = httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        ),
+    )
+    return AsyncOpenAI(api_key=api_key, http_client=http_client)
+
+
 def get_openai_client():
     if is_demo_mode():
         raise RuntimeError("OpenAI nie jest dostępne w trybie demo.")
     key = st.session_state.get("openai_api_key")
     if not key:
         raise RuntimeError("Brak skonfigurowanego klucza OpenAI.")
-    return OpenAI(api_key=key)
+    return get_openai_client_cached(key)
 
-def get_qdrant_client():
+def get_qdrant_client(client_cls=QdrantClient, timeout=None):
     url = env.get("QDRANT_URL")
     api_key = env.get("QDRANT_API_KEY")
     
@@ -91,14 +196,33 @@ def get_qdrant_client():
     if not url or not api_key:
         raise RuntimeError("Missing QDRANT_URL and QDRANT_API_KEY in environment or secrets.")
     
-    return QdrantClient(url=url, api_key=api_key)
+    # gRPC: wektory idą jako spakowane float32 zamiast JSON-a (REST).
+    # Kanał jest współdzielony (cache_resource); zerwany po bezczynności gRPC odtwarza przy następnym wywołaniu.
+    return client_cls(
+        url=url,
+        api_key=api_key,
+        prefer_grpc=True,
+        grpc_port=6334,
+        timeout=timeout,
+    )
 
 @st.cache_resource
 def get_qdrant_client_cached():
     # Prefer cached wrapper if you want to reuse
     return get_qdrant_client()
 
+@st.cache_resource
+def get_async_qdrant_client_cached():
+    # Używany wyłącznie w korutynach na wspólnej pętli (run_async).
+    # Tylko tu limit czasu: lista, wyszukiwanie i zapis nie mogą zawiesić strony. Klient sync (sprawdzenie
+    # kolekcji przy starcie, usuwanie w tle) zostaje bez limitu – tworzenie indeksu może trwać dłużej
+    return get_qdrant_client(AsyncQdrantClient, timeout=QDRANT_REQUEST_TIMEOUT)
+
 def assure_db_collection_exists():
+    # Kolekcja nie znika między rerunami – sprawdzamy ją raz na sesję
+    if st.session_state.get("_qdrant_collection_ok"):
+        return
+
     # Debug: sprawdź czy wartości są poprawnie wczytane (bez pokazywania pełnego klucza)
     url_from_env_raw = env.get("QDRANT_URL")
     url_from_env = url_from_env_raw.strip() if isinstance(url_from_env_raw, str) else None
@@ -113,14 +237,44 @@ def assure_db_collection_exists():
                 collection_name=QDRANT_COLLECTION_NAME,
                 vectors_config=VectorParams(
                     size=EMBEDDING_DIM,
+                    # COSINE zostaje: Qdrant normalizuje wektory przy zapisie i przy wyszukiwaniu liczy
+                    # zwykły iloczyn skalarny, więc DOT nic by nie przyspieszył (a zmiana wymaga nowej kolekcji)
                     distance=Distance.COSINE,
+                    on_disk=True,
                 ),
+                hnsw_config=HnswConfigDiff(m=16, ef_construct=100, full_scan_threshold=10_000),
+                quantization_config=QDRANT_QUANTIZATION_CONFIG,
             )
         else:
             print("Kolekcja już istnieje")
-    except UnexpectedResponse as e:
+            # Starsze kolekcje (bez kwantyzacji lub z innym jej rodzajem, oryginały w RAM) – przestaw bez
+            # odtwarzania danych. Sama kwantyzacja dokłada kopię w RAM; zysk jest dopiero, gdy oryginały
+            # float32 zejdą na dysk (zostają tylko do rescoringu)
+            collection_info = qdrant_client.get_collection(QDRANT_COLLECTION_NAME)
+            collection_update = {}
+            if not isinstance(collection_info.config.quantization_config, type(QDRANT_QUANTIZATION_CONFIG)):
+                collection_update["quantization_config"] = QDRANT_QUANTIZATION_CONFIG
+            vectors_params = collection_info.config.params.vectors
+            if isinstance(vectors_params, VectorParams) and not vectors_params.on_disk:
+                collection_update["vectors_config"] = {"": VectorParamsDiff(on_disk=True)}
+            if collection_update:
+                qdrant_client.update_collection(collection_name=QDRANT_COLLECTION_NAME, **collection_update)
+        # Indeks na created_at pozwala Qdrantowi zwracać notatki posortowane (order_by w scroll)
+        qdrant_client.create_payload_index(
+            collection_name=QDRANT_COLLECTION_NAME,
+            field_name="created_at",
+            field_schema=PayloadSchemaType.INTEGER,
+        )
+        st.session_state["_qdrant_collection_ok"] = True
+    except (UnexpectedResponse, grpc.RpcError) as e:
         error_str = str(e).lower()
-        error_status = getattr(e, 'status_code', None) or (403 if 'forbidden' in error_str or '403' in str(e) else None) or (404 if '404' in str(e) or 'not found' in error_str else None)
+        # Błędy gRPC niosą StatusCode zamiast kodu HTTP
+        grpc_status = {
+            grpc.StatusCode.PERMISSION_DENIED: 403,
+            grpc.StatusCode.UNAUTHENTICATED: 403,
+            grpc.StatusCode.NOT_FOUND: 404,
+        }.get(e.code()) if isinstance(e, grpc.RpcError) else None
+        error_status = getattr(e, 'status_code', None) or grpc_status or (403 if 'forbidden' in error_str or '403' in str(e) else None) or (404 if '404' in str(e) or 'not found' in error_str else None)
         # obsługa błędów połączenia z Qdrant
         if error_status == 403 or 'forbidden' in error_str:
             st.error(
@@ -158,6 +312,16 @@ def assure_db_collection_exists():
                 f"**Szczegóły:** {e}")
         st.stop()
 
+async def warm_up_qdrant_channel(qdrant_client):
+    """Otwiera kanał gRPC klienta async do Qdranta przed pierwszym kliknięciem (sprawdzenie kolekcji idzie klientem sync).
+
+    Błędy są ignorowane – to tylko rozgrzewka, właściwe wywołania i tak obsługują swoje wyjątki.
+    """
+    try:
+        await qdrant_client.collection_exists(QDRANT_COLLECTION_NAME)
+    except Exception as e:
+        print(f"Rozgrzewka połączenia z Qdrant nie powiodła się: {e}")
+
 def startup_access_gate():
     """Na starcie: zweryfikuj klucz z env / Secrets, pokaż formularz lub tryb demo."""
     if is_demo_mode():
@@ -226,48 +390,109 @@ def startup_access_gate():
 
     st.stop()
 
-def get_embeddings(text):
-    openai_client = get_openai_client()
-    result = openai_client.embeddings.create(
+async def get_embeddings_batch(openai_client, texts, model=EMBEDDING_MODEL, dim=EMBEDDING_DIM):
+    """Embeddingi wielu tekstów – jedno żądanie na paczkę zamiast jednego na tekst.
 
-        input=[text],
-        model=EMBEDDING_MODEL,
-        dimensions=EMBEDDING_DIM,
-    )
-    try:
-        return result.data[0].embedding
-    except Exception:
-        if isinstance(result, dict) and "data" in result and isinstance(result["data"], list) and len(result["data"]) > 0:
-            return result["data"][0].get("embedding")
-        raise
+    Zwraca listę wektorów np.float32 w kolejności `texts`. Paczki większe niż limit API idą równolegle.
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+
+    async def _embed(chunk):
+        result = await openai_client.embeddings.create(
+            input=chunk,
+            model=model,
+            dimensions=dim,
+            # base64 -> jeden ciągły bufor float32 zamiast listy 3072 obiektów float
+            encoding_format="base64",
+        )
+        return [
+            np.frombuffer(base64.b64decode(d.embedding), dtype=np.float32)
+            for d in sorted(result.data, key=lambda d: d.index)
+        ]
 
-def transcribe_audio(audio_bytes):
-    openai_client = get_openai_client()
-    audio_file = BytesIO(audio_bytes)
-    audio_file.name = "audio.mp3"
-    audio_file.seek(0)
-    try:
-        transcript = openai_client.audio.transcriptions.create(
-            file=audio_file,
-            model=AUDIO_TRANSCRIBE_MODEL,
-            response_format="verbose_json",
+    chunks = [texts[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+    results = await asyncio.gather(*(_embed(chunk) for chunk in chunks))
+    return [vector for chunk_vectors in results for vector in chunk_vectors]
+
+async def get_embeddings(openai_client, text, model=EMBEDDING_MODEL, dim=EMBEDDING_DIM):
+    return (await get_embeddings_batch(openai_client, [text], model=model, dim=dim))[0]
+
+@st.cache_data(ttl=3600, max_entries=1024, show_spinner=False)
+def get_embeddings_cached(text, model, dim, _openai_client):
+    """Embedding z pamięcią podręczną – ten sam tekst (np. zapytanie przy kolejnym rerunie) nie idzie drugi raz do API."""
+    return run_async(get_embeddings(_openai_client, text, model=model, dim=dim))
+
+async def transcribe_audio(openai_client, audio_segment):
+    """Transkrypcja notatki głosowej (AudioSegment z nagrywarki).
+
+    Przygotowanie uploadu (zob. prepare_note_upload) idzie w wątku roboczym, a kawałki są transkrybowane
+    równolegle i sklejane w kolejności. Błędy API są przekazywane wyżej – obsługuje je wywołujący.
+    """
+    audio_chunks = await asyncio.to_thread(prepare_note_upload, audio_segment)
+
+    async def transcribe_chunk(audio_bytes):
+        # Notatka potrzebuje tylko tekstu – bez segmentów i metadanych verbose_json.
+        # Krotka (nazwa, bajty, typ) trafia do SDK bez kopiowania do dodatkowego BytesIO.
+        transcript = await openai_client.audio.transcriptions.create(
+            file=("audio.mp3", audio_bytes, "audio/mpeg"),
+            model=NOTE_TRANSCRIBE_MODEL,
+            response_format="text",
         )
-    except Exception as e:
-        st.error(f"Błąd transkrypcji audio: {e}")
-        return ""
-    text = None
-    if isinstance(transcript, dict):
-        text = transcript.get("text")
-    else:
-        text = getattr(transcript, "text", None)
-        if text is None and hasattr(transcript, "data"):
-            data = getattr(transcript, "data")
-            if isinstance(data, dict):
-                text = data.get("text")
-            elif isinstance(data, list) and len(data) > 0:
-                t0 = data[0]
-                text = getattr(t0, "text", None) or (t0.get("text") if isinstance(t0, dict) else None)
-    return text if isinstance(text, str) else ""
+        return (transcript or "").strip()
+
+    texts = await asyncio.gather(*(transcribe_chunk(chunk) for chunk in audio_chunks))
+    return " ".join(text for text in texts if text)
+
+def trim_silence(audio_segment):
+    """Obcina ciszę na początku i końcu nagrania – Whisper nie przetwarza (ani nie nalicza) pustych sekund"""
+    start = detect_leading_silence(audio_segment, silence_threshold=SILENCE_THRESHOLD_DBFS)
+    end = len(audio_segment) - detect_leading_silence(audio_segment.reverse(), silence_threshold=SILENCE_THRESHOLD_DBFS)
+    if start >= end:
+        # Same ciche nagranie – zostawiamy bez zmian, niech zdecyduje transkrypcja
+        return audio_segment
+    return audio_segment[max(0, start - SILENCE_KEEP_MS):min(len(audio_segment), end + SILENCE_KEEP_MS)]
+
+def export_mp3(audio_segment):
+    """Koduje AudioSegment do MP3 w pamięci"""
+    buffer = BytesIO()
+    audio_segment.export(buffer, format="mp3")
+    # getvalue() oddaje wewnętrzny bufor BytesIO bez kopiowania (bytes(getbuffer()) kopiowałoby całe MP3)
+    return buffer.getvalue()
+
+def split_for_transcription(audio_segment):
+    """Dzieli nagranie na kawałki ~NOTE_CHUNK_MS, tnąc w ostatniej pauzie przed granicą (żeby nie przeciąć słowa).
+
+    Krótkie nagrania (do 1,5 kawałka) zostają w całości – dodatkowe żądanie by się nie opłaciło.
+    """
+    if len(audio_segment) <= NOTE_CHUNK_MS * 3 // 2:
+        return [audio_segment]
+    pause_threshold = audio_segment.dBFS - NOTE_CHUNK_PAUSE_BELOW_DB
+    chunks = []
+    start = 0
+    while len(audio_segment) - start > NOTE_CHUNK_MS * 3 // 2:
+        boundary = start + NOTE_CHUNK_MS
+        window_start = boundary - NOTE_CHUNK_SEARCH_MS
+        pauses = detect_silence(
+            audio_segment[window_start:boundary],
+            min_silence_len=NOTE_CHUNK_PAUSE_MS,
+            silence_thresh=pause_threshold,
+        )
+        # Środek ostatniej pauzy w oknie; bez pauzy – twarde cięcie na granicy
+        cut = window_start + (pauses[-1][0] + pauses[-1][1]) // 2 if pauses else boundary
+        chunks.append(audio_segment[start:cut])
+        start = cut
+    chunks.append(audio_segment[start:])
+    return chunks
+
+def prepare_note_upload(audio_segment):
+    """Nagranie -> kawałki MP3 do transkrypcji: bez ciszy na brzegach, mono 16 kHz, ~NOTE_CHUNK_MS każdy.
+
+    Kodowanie odbywa się dopiero przy transkrypcji – nagranie, którego nikt nie transkrybuje, nie kosztuje nic.
+    """
+    upload_segment = trim_silence(audio_segment).set_channels(1).set_frame_rate(TRANSCRIBE_SAMPLE_RATE)
+    return [export_mp3(chunk) for chunk in split_for_transcription(upload_segment)]
 
 def convert_audio_to_mp3(audio_bytes, input_format="m4a"):
     """Konwertuje plik audio do formatu MP3"""
@@ -342,7 +567,7 @@ def transcribe_audio_with_timestamps(audio_bytes, filename="audio.mp3", language
         api_params["temperature"] = max(0.0, min(1.0, temperature))  # Ogranicz do zakresu 0.0-1.0
     
     try:
-        transcript = openai_client.audio.transcriptions.create(**api_params)
+        transcript = run_async(openai_client.audio.transcriptions.create(**api_params))
     except Exception as e:
         error_msg = str(e)
         # Jeśli użyliśmy konwersji i to nie zadziałało, spróbuj z oryginalnym plikiem
@@ -366,7 +591,7 @@ def transcribe_audio_with_timestamps(audio_bytes, filename="audio.mp3", language
                 if temperature is not None:
                     original_api_params["temperature"] = max(0.0, min(1.0, temperature))
                 
-                transcript = openai_client.audio.transcriptions.create(**original_api_params)
+                transcript = run_async(openai_client.audio.transcriptions.create(**original_api_params))
                 st.success("✅ Transkrypcja z oryginalnym plikiem powiodła się!")
             except Exception as e2:
                 st.error(f"❌ Błąd transkrypcji audio: {error_msg}")
@@ -691,77 +916,176 @@ def generate_txt(transcript_data, output_filename="transkrypcja.txt"):
     buffer.seek(0)
     return buffer
 
-def add_note_to_db(note_text):
-    qdrant_client = get_qdrant_client_cached()
-    import time
+def note_id_for(note_text):
+    """ID punktu z treści (UUID5): ponowny zapis tej samej notatki nadpisuje punkt zamiast go dublować"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, note_text))
 
-    # Używamy timestamp jako ID aby uniknąć konfliktów
-    note_id = int(time.time() * 1000)  # milliseconds timestamp
-    qdrant_client.upsert(
+def forget_deleted_note(note_text):
+    """Notatka usunięta wcześniej w tej sesji i zapisana ponownie ma to samo ID – zdejmujemy jej znacznik usunięcia,
+    inaczej lista ukrywałaby ją do końca sesji."""
+    st.session_state.get("_deleted_ids", set()).discard(note_id_for(note_text))
+
+async def add_notes_to_db(openai_client, qdrant_client, note_texts, vectors=None):
+    """Zapisuje wiele notatek naraz: jedno żądanie o embeddingi i jeden upsert (preferowane API).
+
+    vectors – gotowe embeddingi w kolejności note_texts; bez nich liczone jednym zbiorczym żądaniem.
+    """
+    note_texts = list(note_texts)
+    if not note_texts:
+        return
+    if vectors is None:
+        vectors = await get_embeddings_batch(openai_client, note_texts)
+    created_at = int(time.time() * 1000)  # milliseconds timestamp
+    points = [
+        PointStruct(
+            id=note_id_for(note_text),
+            vector=vector.tolist(),
+            payload={
+                "text": note_text,
+                "created_at": created_at + i,  # zapisujemy timestamp do sortowania
+            },
+        )
+        for i, (note_text, vector) in enumerate(zip(note_texts, vectors))
+    ]
+    await qdrant_client.upsert(
         collection_name=QDRANT_COLLECTION_NAME,
-        points=[
-            PointStruct(
-                id=note_id,
-                vector=get_embeddings(text=note_text),
-                payload={
-                    "text": note_text,
-                    "created_at": note_id,  # zapisujemy timestamp do sortowania
-                },
-            )
-        ]
+        points=points,
     )
 
+async def add_note_to_db(openai_client, qdrant_client, note_text, vector=None):
+    await add_notes_to_db(openai_client, qdrant_client, [note_text], vectors=None if vector is None else [vector])
+
+def save_note(note_text):
+    """Zapis notatki z UI. Embedding idzie przez cache, więc ponowienie po błędzie Qdranta nie odpytuje OpenAI."""
+    openai_client = get_openai_client()
+    vector = get_embeddings_cached(note_text, EMBEDDING_MODEL, EMBEDDING_DIM, openai_client)
+    run_async(add_note_to_db(openai_client, get_async_qdrant_client_cached(), note_text, vector=vector))
+    forget_deleted_note(note_text)
+
 def delete_note_from_db(note_id):
-    qdrant_client = get_qdrant_client_cached()
-    qdrant_client.delete(
-        collection_name=QDRANT_COLLECTION_NAME,
-        points_selector=[note_id],
-    )
+    """Usuwa notatkę w tle – UI nie czeka na Qdranta, a lista od razu ją ukrywa (_deleted_ids).
 
-def list_notes_from_db(query=None):
-    """Pobiera notatki: wszystkie (bez query) lub semantycznie (z query)"""
+    Nieudane usunięcia trafiają do _failed_deletes; reconcile_failed_deletes() przywraca je przy kolejnym przebiegu.
+    """
     qdrant_client = get_qdrant_client_cached()
+    st.session_state.setdefault("_deleted_ids", set()).add(note_id)
+    # Wątek nie ma kontekstu Streamlit – dopisuje do listy z sesji, a odczytuje ją dopiero kolejny przebieg skryptu
+    failed_deletes = st.session_state.setdefault("_failed_deletes", [])
+
+    def _delete():
+        try:
+            qdrant_client.delete(
+                collection_name=QDRANT_COLLECTION_NAME,
+                points_selector=[note_id],
+            )
+        except Exception as e:
+            print(f"Nie udało się usunąć notatki {note_id}: {e}")
+            failed_deletes.append((note_id, str(e)))
+
+    threading.Thread(target=_delete, daemon=True).start()
+
+def reconcile_failed_deletes():
+    """Notatki, których nie udało się usunąć w tle, wracają na listę (zdjęty znacznik usunięcia) z ostrzeżeniem."""
+    failed_deletes = st.session_state.get("_failed_deletes")
+    deleted_ids = st.session_state.get("_deleted_ids", set())
+    while failed_deletes:
+        note_id, error = failed_deletes.pop(0)
+        deleted_ids.discard(note_id)
+        st.warning(f"Nie udało się usunąć notatki – wraca na listę. Szczegóły: {error}")
+
+def _note_from_point(point):
+    """Zamienia punkt z Qdranta (scroll lub query_points) na słownik notatki do wyświetlenia."""
+    payload = point.payload or {}
+    score = getattr(point, "score", None)
+    return {
+        "id": point.id,
+        "text": payload.get("text", ""),
+        "created_at": payload.get("created_at", 0),
+        "score": round(score, 3) if score is not None else None,
+    }
+
+async def list_notes_from_db(qdrant_client, query_vector=None, exclude_ids=()):
+    """Pobiera notatki: wszystkie (bez query_vector) lub semantycznie (z embeddingiem zapytania).
 
-    if not query:
-        notes = qdrant_client.scroll(
+    exclude_ids – notatki usunięte w tej sesji, których kasowanie w tle mogło się jeszcze nie zakończyć.
+    """
+    if query_vector is None:
+        notes = (await qdrant_client.scroll(
             collection_name=QDRANT_COLLECTION_NAME,
+            # Najnowsze 100 – sortowanie po stronie Qdranta (indeks na created_at)
+            order_by=OrderBy(key="created_at", direction=Direction.DESC),
             limit=100,
-            with_payload=True,
+            with_payload=NOTE_PAYLOAD_SELECTOR,
             with_vectors=False,
-        )[0]
-
-        result = []
-        for note in notes:
-            payload = note.payload or {}
-            result.append({
-                "id": note.id,
-                "text": payload.get("text", ""),
-                "created_at": payload.get("created_at", 0),
-                "score": None,
-            })
-        result.sort(key=lambda x: x["created_at"], reverse=True)
-        return result
+        ))[0]
     else:
         # Wyszukiwanie semantyczne
-        notes = qdrant_client.search(
+        # query_points zastępuje przestarzałe search (usunięte w nowszych qdrant-client)
+        notes = (await qdrant_client.query_points(
             collection_name=QDRANT_COLLECTION_NAME,
-            query_vector=get_embeddings(text=query),
-
-            limit=100,
-            with_payload=True,
-        )
+            query=query_vector,
+            search_params=QDRANT_SEARCH_PARAMS,
+            limit=SEARCH_RESULTS_LIMIT,
+            with_payload=NOTE_PAYLOAD_SELECTOR,
+        )).points
+
+    # Tekst, data i wynik przychodzą w jednej odpowiedzi – tylko przepakowanie do słowników
+    return [_note_from_point(note) for note in notes if note.id not in exclude_ids]
+
+def remember_transcript(audio_hash, note_text):
+    """Zapamiętuje transkrypcję nagrania w sesji; najstarsze wpisy wypadają po TRANSCRIPT_MEMO_MAX_ENTRIES."""
+    transcripts = st.session_state.setdefault("_transcripts", {})
+    transcripts.pop(audio_hash, None)
+    transcripts[audio_hash] = note_text
+    while len(transcripts) > TRANSCRIPT_MEMO_MAX_ENTRIES:
+        del transcripts[next(iter(transcripts))]
+
+@st.fragment(run_every=1)
+def poll_transcription():
+    """Sprawdza co sekundę transkrypcję działającą w tle; po zakończeniu przerysowuje całą stronę."""
+    future = st.session_state.get("transcribe_future")
+    if future is None:
+        return
+    if not future.done():
+        st.info("⏳ Transkrypcja w toku...")
+        return
+    st.session_state.pop("transcribe_future", None)
+    try:
+        st.session_state["note_audio_text"] = future.result()
+        # Klucz: odcisk nagrania – nowe nagranie anuluje oczekującą transkrypcję, więc odcisk jest aktualny
+        remember_transcript(st.session_state["note_audio_bytes_hash"], future.result())
+    except Exception as e:
+        st.session_state["note_audio_text"] = ""
+        st.session_state["_transcribe_error"] = str(e)
+    st.rerun()
+
+@st.fragment
+def render_notes(notes):
+    """Lista notatek jako fragment – usunięcie przerysowuje tylko listę, bez rerunu całej aplikacji."""
+    reconcile_failed_deletes()
+    deleted_ids = st.session_state.get("_deleted_ids", set())
+    notes = [note for note in notes if note["id"] not in deleted_ids]
+    if not notes:
+        st.info("Nie znaleziono żadnych notatek")
+        return
+    for note in notes:
+        with st.container():
+            col1, col2 = st.columns([5,1])
+            with col1:
+                st.markdown(note["text"])
+                if note["score"] is not None:
+                    st.markdown(f':violet[{note["score"]}]')
+            with col2:
+                if st.button(
+                    "🗑️",
+                    key=f"delete_{note['id']}",
+                    help="Usuń notatkę",
+                    disabled=is_demo_mode(),
+                ):
+                    delete_note_from_db(note["id"])
+                    st.toast("Notatka usunięta", icon="🗑️")
+                    st.rerun(scope="fragment")
 
-        result = []
-        for note in notes:
-            payload = note.payload or {}
-            result.append({
-                "id": note.id,
-                "text": payload.get("text", ""),
-                "created_at": payload.get("created_at", 0),
-                "score": note.score,
-            })
-        return result
-    
 #=======================================================
 # MAIN
 st.set_page_config(
@@ -789,11 +1113,20 @@ HIDE_STREAMLIT_STYLE = """
 """
 st.markdown(HIDE_STREAMLIT_STYLE, unsafe_allow_html=True)
 
+HERO_TITLE_HTML = (
+    "<h1 style='background: linear-gradient(130deg, #eb2a91ff 25%, #1567eaff 60%); "
+    "-webkit-background-clip: text; -webkit-text-fill-color: transparent;'>🎤 Audio Notatki 📝</h1>"
+)
+HERO_DESCRIPTION_HTML = """
+Aplikacja do tworzenia szybkich notatek z transkrypcji audio, z zapisem w bazie danych Qdrant.<br>
+Wyszukiwanie w zapisanych działa semantycznie z wykorzystaniem modelu AI.
+"""
+
 startup_access_gate()
 
 # Session state initialization
-if "note_audio_bytes_md5" not in st.session_state:
-    st.session_state["note_audio_bytes_md5"] = None
+if "note_audio_bytes_hash" not in st.session_state:
+    st.session_state["note_audio_bytes_hash"] = None
 
 if "note_audio_bytes" not in st.session_state:
     st.session_state["note_audio_bytes"] = None
@@ -834,11 +1167,8 @@ with column1:
     else:
         st.markdown("<div style='font-size: 56px; line-height: 1;'>🎤</div>", unsafe_allow_html=True)
 with column2:
-    st.markdown("<h1 style='background: linear-gradient(130deg, #eb2a91ff 25%, #1567eaff 60%); -webkit-background-clip: text; -webkit-text-fill-color: transparent;'>🎤 Audio Notatki 📝</h1>", unsafe_allow_html=True)
-st.markdown("""
-Aplikacja do tworzenia szybkich notatek z transkrypcji audio, z zapisem w bazie danych Qdrant.<br>
-Wyszukiwanie w zapisanych działa semantycznie z wykorzystaniem modelu AI.
-""", unsafe_allow_html=True)
+    st.markdown(HERO_TITLE_HTML, unsafe_allow_html=True)
+st.markdown(HERO_DESCRIPTION_HTML, unsafe_allow_html=True)
 
 if is_demo_mode():
     d1, d2 = st.columns([4, 1])
@@ -863,11 +1193,15 @@ if db_configured:
 else:
     st.warning("Konfiguracja Qdrant nie ustawiona. Aby zapisywać notatki, ustaw QDRANT_URL i QDRANT_API_KEY w .env lub Secrets.")
 
-selected = option_menu(None, ["Dodaj notatkę", "Wyszukaj notatkę", "Transkrypcja z pliku"],
-    icons=['record', 'search', 'file-audio'], 
-    menu_icon="cast", default_index=0, orientation="horizontal")
+# Lokalnych modeli nie ma, więc "rozgrzewka" to nawiązanie połączenia – w tle, raz na sesję.
+# Połączenie z OpenAI otwiera już walidacja klucza (models.list na tym samym kliencie)
+if db_configured and not st.session_state.get("_qdrant_channel_warmed"):
+    submit_async(warm_up_qdrant_channel(get_async_qdrant_client_cached()))
+    st.session_state["_qdrant_channel_warmed"] = True
 
-if selected == "Dodaj notatkę":
+@st.fragment
+def add_note_tab():
+    """Zakładka "Dodaj notatkę" jako fragment – nagrywanie i transkrypcja nie przerysowują reszty strony."""
     if is_demo_mode():
         st.caption("Tryb demo: nagranie działa lokalnie, ale transkrypcja i zapis do bazy wymagają klucza API.")
     note_audio = audiorecorder(
@@ -875,19 +1209,41 @@ if selected == "Dodaj notatkę":
         stop_prompt="Zatrzymaj nagrywanie",
     )
     if note_audio:
-        audio = BytesIO()
-        note_audio.export(audio, format="mp3")
-        st.session_state["note_audio_bytes"] = audio.getvalue()
-        current_md5 = md5(st.session_state["note_audio_bytes"]).hexdigest()
-        if st.session_state["note_audio_bytes_md5"] != current_md5:
-            st.session_state["note_audio_text"] = ""
-            st.session_state["note_text"] = ""
-            st.session_state["note_audio_bytes_md5"] = current_md5
+        # Odcisk PCM z nagrywarki (xxh3, tylko do wykrycia zmiany) – kodowanie do MP3 tylko dla nowego
+        # nagrania, a nie przy każdym rerunie
+        current_hash = xxhash.xxh3_128_hexdigest(note_audio.raw_data)
+        if st.session_state["note_audio_bytes_hash"] != current_hash:
+            # Jedna aktualizacja zamiast kilku przypisań – nowe nagranie podmienia stan w całości.
+            # Tu powstaje tylko MP3 do odtwarzacza; kopia do transkrypcji jest kodowana w tle (transcribe_audio)
+            st.session_state.update({
+                "note_audio_bytes": export_mp3(note_audio),
+                "note_audio_text": "",
+                "note_text": "",
+                "note_audio_bytes_hash": current_hash,
+            })
+            # Transkrypcja poprzedniego nagrania nie dotyczy już tego – anulujemy ją, żeby nie wysyłała
+            # (i nie naliczała) starego audio; cancel() przechodzi z Future na zadanie w pętli asyncio
+            stale_future = st.session_state.pop("transcribe_future", None)
+            if stale_future is not None:
+                stale_future.cancel()
 
         st.audio(st.session_state["note_audio_bytes"], format="audio/mp3")
 
         if st.button("🖋️Transkrybuj audio", disabled=is_demo_mode()):
-            st.session_state["note_audio_text"] = transcribe_audio(st.session_state["note_audio_bytes"])
+            # To samo nagranie było już transkrybowane – wynik z pamięci, bez ponownego wywołania Whispera
+            cached_text = st.session_state.get("_transcripts", {}).get(current_hash)
+            if cached_text is not None:
+                st.session_state["note_audio_text"] = cached_text
+            else:
+                # Transkrypcja idzie w tle (wspólna pętla asyncio) – strona nie jest zablokowana na czas Whispera
+                st.session_state["transcribe_future"] = submit_async(
+                    transcribe_audio(get_openai_client(), note_audio)
+                )
+        if st.session_state.get("transcribe_future") is not None:
+            poll_transcription()
+        transcribe_error = st.session_state.pop("_transcribe_error", None)
+        if transcribe_error:
+            st.error(f"Błąd transkrypcji audio: {transcribe_error}")
 
         if st.session_state["note_audio_text"]:
             st.session_state["note_text"] = st.text_area("Edytuj notatkę", value=st.session_state["note_audio_text"])
@@ -896,15 +1252,26 @@ if selected == "Dodaj notatkę":
             "Zapisz notatkę",
             disabled=not st.session_state["note_text"] or is_demo_mode(),
         ):
-            add_note_to_db(note_text=st.session_state["note_text"])
+            save_note(st.session_state["note_text"])
             st.toast("Notatka zapisana", icon="💾")
-            st.session_state["note_text"] = ""
-            st.session_state["note_audio_text"] = ""
-            st.session_state["note_audio_bytes"] = None
-            st.session_state["note_audio_bytes_md5"] = None
+            st.session_state.update(NOTE_STATE_RESET)
             st.rerun()
-elif selected == "Wyszukaj notatkę":
-    query = st.text_input("Wyszukaj notatkę")
+
+@st.fragment
+def search_notes_tab():
+    """Zakładka "Wyszukaj notatkę" jako fragment – wpisywanie frazy nie uruchamia ponownie całej aplikacji."""
+    # Przed pobraniem listy – notatki z nieudanym usunięciem nie mogą być z niej wykluczone
+    reconcile_failed_deletes()
+    # Pusta fraza = lista wszystkich notatek; pobieranie startuje od razu, a Qdrant odpowiada,
+    # zanim dorysujemy resztę zakładki
+    notes_prefetch = None
+    if db_configured and not st.session_state.get("search_query"):
+        notes_prefetch = submit_async(list_notes_from_db(
+            get_async_qdrant_client_cached(),
+            exclude_ids=set(st.session_state.get("_deleted_ids", set())),
+        ))
+
+    query = st.text_input("Wyszukaj notatkę", key="search_query")
     query_raw = (query or "").strip()
     demo_semantic_blocked = is_demo_mode() and bool(query_raw)
     if demo_semantic_blocked:
@@ -922,28 +1289,31 @@ elif selected == "Wyszukaj notatkę":
         if search_clicked or not query:
             if demo_semantic_blocked:
                 notes = []
+            elif notes_prefetch is not None:
+                with st.spinner("Wczytuję notatki..."):
+                    notes = notes_prefetch.result()
             else:
-                notes = list_notes_from_db(query_raw if query_raw else None)
-            if not notes:
-                st.info("Nie znaleziono żadnych notatek")
-            else:
-                for note in notes:
-                    with st.container():
-                        col1, col2 = st.columns([5,1])
-                        with col1:
-                            st.markdown(note["text"])
-                            if note["score"]:
-                                st.markdown(f':violet[{note["score"]}]')
-                        with col2:
-                            if st.button(
-                                "🗑️",
-                                key=f"delete_{note['id']}",
-                                help="Usuń notatkę",
-                                disabled=is_demo_mode(),
-                            ):
-                                delete_note_from_db(note["id"])
-                                st.toast("Notatka usunięta", icon="🗑️")
-                                st.rerun()
+                with st.spinner("Szukam..."):
+                    query_vector = None
+                    if query_raw:
+                        # Znormalizowana fraza jako klucz cache: "Zakupy " i "zakupy" to jedno zapytanie do API
+                        query_normalized = " ".join(query_raw.split()).lower()
+                        query_vector = get_embeddings_cached(query_normalized, EMBEDDING_MODEL, EMBEDDING_DIM, get_openai_client())
+                    notes = run_async(list_notes_from_db(
+                        get_async_qdrant_client_cached(),
+                        query_vector,
+                        exclude_ids=st.session_state.get("_deleted_ids", set()),
+                    ))
+            render_notes(notes)
+
+selected = option_menu(None, ["Dodaj notatkę", "Wyszukaj notatkę", "Transkrypcja z pliku"],
+    icons=['record', 'search', 'file-audio'], 
+    menu_icon="cast", default_index=0, orientation="horizontal")
+
+if selected == "Dodaj notatkę":
+    add_note_tab()
+elif selected == "Wyszukaj notatkę":
+    search_notes_tab()
 elif selected == "Transkrypcja z pliku":
     st.markdown("### 📁 Wczytaj plik audio z dysku lub URL")
     if is_demo_mode():
@@ -1225,7 +1595,7 @@ elif selected == "Transkrypcja z pliku":
                     try:
                         transcript_text = format_transcript_as_text(transcript_data)
                         if transcript_text:
-                            add_note_to_db(note_text=transcript_text)
+                            save_note(transcript_text)
                             st.toast("✅ Transkrypcja zapisana jako notatka!", icon="💾")
                         else:
                             st.error("❌ Nie można zapisać pustej transkrypcji")